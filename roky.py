@@ -53,6 +53,29 @@ which will use the Consolas font with the specified pixel height.
 Unicode characters above 1300 are rendered as one or two \uhhhh sequences.
 Note that some of the ASCII control characters are escaped as \xhh.
 Other ASCII control characters from the Roku are output as space or "?".
+Terminals with full Unicode support, e.g. Windows Terminal, show all characters.
+Use -u legacy, unicode or ascii to override the automatic choice of renderer.
+
+Use -p to capture other Roku ports along with the main debugging port,
+e.g. -p 8080 -p 8089. Each line of output is tagged with its port.
+With -o, the merged, time-stamped output is logged to the -o file,
+and each port's output to its own file, e.g. roky-8080.log.
+
+Use -r to collapse runs of repeated lines into a single line and a [×N] count.
+Use -n regex to ignore the text matching regex when comparing lines, e.g. -n "\d+".
+Use -k to log output to a compact file, with repeated lines collapsed.
+
+Use -m file to sample the channel's CPU and memory usage with chanperf on port
+8080, appending the samples to a time-series file. Use -s to set the sampling
+interval in seconds (default 5). The latest sample is shown in the window title.
+
+Use -d dir to show the source code for each pkg:/file(line) in backtraces and
+runtime errors, taken from the channel source tree in dir.
+
+Use -x cprofile, sample or memory to profile roky itself, written on exit.
+Profiling can also be controlled by typing commands in the small window:
+roky profile start [cprofile|sample|memory], roky profile stop,
+and (for memory profiling) roky profile snapshot.
 
 You can also set your console window's buffer size, e.g:
 Properties>Layout>Screen Buffer Size>Height set to 9999
@@ -74,12 +97,19 @@ Documentation and source code at https://github.com/belltown/roky
 # There are two general data flows:
 # (1) User input (child proc) => console thread (main proc) => Roku writer thread AND console output (main window).
 # (2) Roku => Roku reader thread (main proc) => console output (main window) AND log file.
+# If chanperf sampling is enabled (-m or -s), a chanperf sampler thread polls port 8080 on its own connection,
+# writing samples to a time-series file, and a summary to the console window's title.
+# When several Roku ports are captured (-p), each port has its own Roku reader thread and log file, and flow (2) becomes:
+# (2a) Roku ports => Roku reader threads (main proc) => timeline thread => merged console output AND merged log file.
 #
 # The reason for using two consoles is that Windows won't allow a process to be reading and writing to the console simultaneously.
 # Since readline() is a blocking operation with no provisions for a timeout, there would be no way to display
 # Roku Debugger output on the console until the user presses the enter key to complete the current read operation.
 # It's possible to read the console a character at a time using the msvcrt module, but then you'd lose the readline functionality.
 #
+# Other Python programs can import roky and use DebugSession to run the Roku reader and writer threads in-process,
+# with no consoles or child process: its SessionOutput object takes the place of both the console output and the quit queue.
+#
 # Ctrl/C, which causes the BrightScript debugger to break execution, is handled by using a custom SIGINT handler.
 # All this handler does is to return, thus preventing the KeyboardInterrupt event from being raised.
 # In turn, an EOFError event is raised in the child process's console window which can easily be handled.
@@ -89,6 +119,8 @@ Documentation and source code at https://github.com/belltown/roky
 
 ROKU = '192.168.0.6'    # May be overridden using the 1st positional command-line argument
 PORT = 8085             # May be overridden using the 2nd positional command-line argument
+PERF_PORT = 8080        # Port on which the chanperf sampler (-m or -s) issues chanperf commands
+PERF_PRINT = 60         # Seconds between chanperf summaries printed to the console, if they can't be shown in its title
 
 import sys
 
@@ -100,32 +132,46 @@ if sys.version_info.major < 3 or (sys.version_info.major == 3 and sys.version_in
 import os
 import io
 import re
+import json
 import time
+import heapq
+import bisect
 import queue
+import codecs
+import pstats
+import marshal
+import cProfile
+import hashlib
+import struct
 import ctypes
 import ctypes.wintypes
+import atexit
 import signal
+import select
 import socket
+import asyncio
 import argparse
+import collections
+import itertools
 import threading
 import subprocess
-
-# Printable ASCII characters will be printed as-is (including TAB, CR and LF). The rest will be hex backslash-escaped.
-# Unfortunately, the Roku won't output several of the ASCII control codes, outputting question marks or spaces instead.
-printable = [
-    0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
-    1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1,
-    1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1,
-    1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0
-    ]
+import tracemalloc
 
 # Use a lock to control access to the print function by all threads
 printLock = threading.Lock()
 
+# The line collapser that left the console's current line unfinished, to update the "[×N]" count on it in place, if any.
+# tPrint() ends that line before printing, so the collapser knows to write its next count on a new line.
+unfinishedLine = None
+
 def tPrint(s):
-    '''Thread-safe print function.'''
+    '''Thread-safe print function, starting on a new line if a line collapser left the current line unfinished.'''
 
+    global unfinishedLine
     acquiredLock = printLock.acquire(timeout=5)
+    if unfinishedLine:
+        unfinishedLine = None
+        print()
     print(s)
     if acquiredLock: printLock.release()
 
@@ -137,10 +183,212 @@ def tPrintFlush(s):
     if acquiredLock: printLock.release()
 
 
+class Profiler():
+    '''Profile roky's own threads from within the session, using cProfile, a stack sampler, or tracemalloc.
+
+    Each roky thread compares the profiler's generation with its own on each pass through its loop,
+    calling checkpoint() when they differ. That comparison is all that profiling costs when it is off.
+    '''
+
+    MODES = ('cprofile', 'sample', 'memory')
+    SAMPLE_INTERVAL = 0.005     # Seconds between stack samples
+    TOP_GROWTH = 25             # Number of source lines listed in each tracemalloc growth report
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.mode = None            # The kind of profiling currently running, if any
+        self.generation = 0         # Incremented each time profiling starts or stops
+        self.base = None            # File name prefix for the current profile's output files
+        self.runs = 0               # Number of times profiling has been started, so each run's files have their own names
+        self.profile = None         # The single cProfile.Profile that covers all threads in Python 3.12+
+        self.profiles = {}          # Before Python 3.12, the thread name and cProfile.Profile of each thread, keyed by thread id
+        self.retired = {}           # Stopped profiles, each disabled by its own thread at its next checkpoint
+        self.sampler = None         # The stack sampler thread
+        self.samplerStop = None     # Event that tells the stack sampler thread to finish
+        self.samples = None         # Number of times each (collapsed) stack was sampled
+        self.snapshots = 0          # Number of tracemalloc snapshots taken
+        self.firstSnapshot = None   # The tracemalloc snapshot taken when memory profiling started
+
+    def checkpoint(self):
+        '''Start or stop cProfile-profiling the calling thread to match the current mode, returning the current generation.'''
+
+        ident = threading.get_ident()
+        with self.lock:
+            retired = self.retired.pop(ident, None)
+            if retired:
+                retired.disable()
+
+            # Before Python 3.12, a profile only covers the thread that enables it, so each thread has its own
+            if self.mode == 'cprofile' and not self.profile and ident not in self.profiles:
+                profile = cProfile.Profile()
+                profile.enable()
+                self.profiles[ident] = (threading.current_thread().name, profile)
+
+            return self.generation
+
+    def command(self, words):
+        '''Carry out an in-session "roky profile" command, given the words following it, returning a message for the user.'''
+
+        try:
+            if words[:1] == ['start'] and len(words) <= 2:
+                mode = words[1] if len(words) > 1 else 'cprofile'
+                if mode in Profiler.MODES:
+                    return self.start(mode)
+            elif words == ['stop']:
+                return self.stop()
+            elif words == ['snapshot']:
+                return self.snapshot()
+            elif not words:
+                return "roky: {} profiling is running".format(self.mode) if self.mode else "roky: Profiling is not running"
+        except Exception as e:
+            return "\n{}\n\nroky: Unable to write profile".format(e)
+        return "roky: Usage: roky profile [start [{}] | stop | snapshot]".format('|'.join(Profiler.MODES))
+
+    def start(self, mode):
+        '''Start profiling in the specified mode, returning a message for the user.'''
+
+        with self.lock:
+            if self.mode:
+                return "roky: {} profiling is already running".format(self.mode)
+
+            self.runs += 1
+            self.base = '{}-{}'.format(time.strftime('roky-profile-%Y%m%d-%H%M%S'), self.runs)
+            if mode == 'cprofile' and sys.version_info >= (3, 12):
+                # From Python 3.12, a single profile covers every thread
+                self.profile = cProfile.Profile()
+                self.profile.enable()
+            elif mode == 'sample':
+                self.samples = collections.Counter()
+                self.samplerStop = threading.Event()
+                self.sampler = threading.Thread(target=self.sampleThreads, args=(self.samplerStop,), daemon=True)
+                self.sampler.start()
+            elif mode == 'memory':
+                tracemalloc.start(25)
+                self.firstSnapshot = tracemalloc.take_snapshot()
+                self.snapshots = 0
+
+            self.mode = mode
+            self.generation += 1
+
+        return "roky: Started {} profiling".format(mode)
+
+    def stop(self):
+        '''Stop profiling, writing the profile to disk, and returning a message for the user.'''
+
+        with self.lock:
+            if not self.mode:
+                return "roky: Profiling is not running"
+            mode, self.mode = self.mode, None
+            self.generation += 1
+
+            if mode == 'cprofile':
+                files = self.stopCprofile()
+            elif mode == 'sample':
+                files = self.stopSampler()
+            else:
+                files = self.writeSnapshot()
+                tracemalloc.stop()
+                self.firstSnapshot = None
+
+        return "roky: Stopped {} profiling. Written to: {}".format(mode, ', '.join(files) or 'nothing profiled')
+
+    def stopCprofile(self):
+        '''Write the cProfile statistics for all the threads profiled, returning the file names. Must hold the lock.'''
+
+        fileName = self.base + '.prof'
+        if self.profile:
+            self.profile.disable()
+            self.profile.dump_stats(fileName)
+            self.profile = None
+            return [fileName]
+
+        # Write each thread's statistics to its own file, then combine them.
+        # A profile can only be disabled by its own thread, so just take a snapshot of its statistics for now.
+        threadFiles = []
+        for ident, (name, profile) in self.profiles.items():
+            profile.snapshot_stats()
+            threadFile = '{}-{}.prof'.format(self.base, re.sub(r'\W+', '_', name))
+            with open(threadFile, 'wb') as f:
+                marshal.dump(profile.stats, f)
+            threadFiles.append(threadFile)
+            self.retired[ident] = profile
+        self.profiles = {}
+
+        if not threadFiles:
+            return []
+        pstats.Stats(*threadFiles).dump_stats(fileName)
+        return [fileName] + threadFiles
+
+    def sampleThreads(self, stop):
+        '''Within the main process, sample the stacks of all other threads until stop is set.'''
+
+        ownIdent = threading.get_ident()
+        while not stop.wait(Profiler.SAMPLE_INTERVAL):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == ownIdent:
+                    continue
+                stack = []
+                while frame:
+                    stack.append('{}:{}'.format(os.path.basename(frame.f_code.co_filename), frame.f_code.co_name))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def stopSampler(self):
+        '''Stop the stack sampler, writing the samples in collapsed-stack format, returning the file names. Must hold the lock.'''
+
+        self.samplerStop.set()
+        self.sampler.join()
+        self.sampler = None
+
+        # One line for each distinct stack, as used by flamegraph.pl and speedscope: thread;outer;...;inner count
+        fileName = self.base + '-samples.txt'
+        with open(fileName, 'w') as f:
+            for stack, count in self.samples.most_common():
+                f.write('{} {}\n'.format(stack, count))
+        self.samples = None
+        return [fileName]
+
+    def snapshot(self):
+        '''Write a tracemalloc snapshot while memory profiling is running, returning a message for the user.'''
+
+        with self.lock:
+            if self.mode != 'memory':
+                return "roky: Snapshots need memory profiling: roky profile start memory"
+            files = self.writeSnapshot()
+        return "roky: Snapshot written to: {}".format(', '.join(files))
+
+    def writeSnapshot(self):
+        '''Write a tracemalloc snapshot, and a report of the memory growth since profiling started. Must hold the lock.'''
+
+        self.snapshots += 1
+        snapshot = tracemalloc.take_snapshot()
+        fileName = '{}-{}.tracemalloc'.format(self.base, self.snapshots)
+        snapshot.dump(fileName)
+
+        reportName = '{}-{}.txt'.format(self.base, self.snapshots)
+        with open(reportName, 'w') as f:
+            for stat in snapshot.compare_to(self.firstSnapshot, 'lineno')[:Profiler.TOP_GROWTH]:
+                f.write('{}\n'.format(stat))
+        return [fileName, reportName]
+
+# Profiles roky itself, when started using the -x command-line option or the "roky profile" command
+profiler = Profiler()
+
+def stopProfilerAtExit():
+    '''Write out the profile if profiling is still running when roky exits, however it exits, e.g. after a Ctrl/C.'''
+
+    if profiler.mode:
+        tPrint(profiler.stop())
+
+atexit.register(stopProfilerAtExit)
+
+
 ################ Windows API Code ################
 
-# Win32 API
-Win32 = ctypes.windll.kernel32
+# Win32 API. Not available on other platforms, where roky can still be imported to use DebugSession.
+Win32 = ctypes.windll.kernel32 if os.name == 'nt' else None
 
 # Win32 Data Types and Constants
 BOOL                    = ctypes.wintypes.BOOL
@@ -156,15 +404,18 @@ FALSE                   = BOOL(0)
 STD_OUTPUT_HANDLE       = DWORD(-11)
 INVALID_HANDLE_VALUE    = -1
 FILE_TYPE_CHAR          = 0x0002
+FILE_TYPE_PIPE          = 0x0003
 LF_FACESIZE             = 32
 
 # Win32 API functions
-GetFileType             = Win32.GetFileType
-GetStdHandle            = Win32.GetStdHandle
-WriteConsoleW           = Win32.WriteConsoleW
-GetConsoleMode          = Win32.GetConsoleMode
-GetCurrentConsoleFontEx = Win32.GetCurrentConsoleFontEx
-SetCurrentConsoleFontEx = Win32.SetCurrentConsoleFontEx
+if Win32:
+    GetFileType             = Win32.GetFileType
+    GetStdHandle            = Win32.GetStdHandle
+    WriteConsoleW           = Win32.WriteConsoleW
+    GetConsoleMode          = Win32.GetConsoleMode
+    GetCurrentConsoleFontEx = Win32.GetCurrentConsoleFontEx
+    SetCurrentConsoleFontEx = Win32.SetCurrentConsoleFontEx
+    SetConsoleTitleW        = Win32.SetConsoleTitleW
 
 class COORD(ctypes.Structure):
     '''Win32 COORD Struct.'''
@@ -244,8 +495,13 @@ class Console:
         '''Determine whether stdout serves an actual Windows Console.'''
 
         self.console = False
+        self.mintty = False
         self.hStdOut = None
 
+        # Not a Windows console if the Win32 API isn't available
+        if not Win32:
+            return
+
         # Check whether we are writing to an actual Windows console, or something else (e.g. MinGW)
         self.hStdOut = GetStdHandle(STD_OUTPUT_HANDLE)
 
@@ -263,6 +519,10 @@ class Console:
                 if GetConsoleMode(self.hStdOut, ctypes.byref(DWORD())) != 0:
                     self.console = True
 
+            # MinGW's mintty is a terminal, but is seen as a pipe. MinGW sets MSYSTEM, and mintty sets TERM.
+            elif fileType == FILE_TYPE_PIPE and os.environ.get('MSYSTEM') and os.environ.get('TERM', 'dumb') != 'dumb':
+                self.mintty = True
+
     def write(self, text):
         '''Write to the Windows Console using the Win32 API, rather than print, if possible.'''
 
@@ -271,34 +531,202 @@ class Console:
         # assuming the font in use supports the necessary code points.
         if self.console:
             nWritten = DWORD(0)
-            bRet = WriteConsoleW(self.hStdOut, text, len(text), ctypes.byref(nWritten), NULL)
+            # The length is in UTF-16 code units, not code points; each character beyond the BMP takes two of them
+            bRet = WriteConsoleW(self.hStdOut, text, len(text.encode('utf-16-le')) // 2, ctypes.byref(nWritten), NULL)
             if bRet == 0:
                 # Error -- fallback to using print
                 tPrintFlush(text)
         else:
             tPrintFlush(text)
 
+    def setTitle(self, title):
+        '''Set the console window's title, used as a status line that doesn't get mixed up with the debugger output.
+
+        Returns False if there's no title to set, e.g. when output is redirected to a file.
+        '''
+
+        if self.console:
+            SetConsoleTitleW(title)
+        elif self.mintty or sys.stdout.isatty():
+            # Non-Windows consoles, e.g. MinGW's mintty, set the title using an xterm escape sequence
+            tPrintFlush('\x1b]0;{}\x07'.format(title))
+        else:
+            return False
+        return True
+
 ########### End Windows API code ############
 
 
+class LineCollapser():
+    '''Collapse each run of consecutive identical lines into the first line of the run, followed by a "[×N]" line.
+
+    While a run is still going, each idle flush writes the count so far on a line of its own:
+
+    >>> collapser = LineCollapser()
+    >>> ''.join(collapser.feed('warning\\n') + collapser.flush() for i in range(6)) + collapser.feed('done\\n')
+    'warning\\n[×2]\\n[×3]\\n[×4]\\n[×5]\\n[×6]\\ndone\\n'
+
+    When writing to a console that nothing else writes to part-way through a line, the count can be updated in place instead:
+
+    >>> collapser = LineCollapser(inPlace=True)
+    >>> ''.join(collapser.feed('warning\\n') + collapser.flush() for i in range(6)) + collapser.feed('done\\n')
+    'warning\\n[×2]\\r[×3]\\r[×4]\\r[×5]\\r[×6]\\ndone\\n'
+    '''
+
+    # When a collapser is holding back output, write it out if nothing more arrives within this many seconds
+    IDLE_FLUSH = 0.25
+
+    def __init__(self, pattern=None, renderer=None, inPlace=False):
+        '''Lines are identical if they match once all matches of the (optional) normalizing regex pattern are removed.
+
+        The counts are written using "×" if the (optional) renderer can display it, otherwise using "x".
+        If inPlace is True, the count is left on an unfinished line, overwritten (using CR) by the next count.
+        Only use this for the console, when there is no other output that could end up part-way through the line;
+        tPrint() is fine, as it ends the unfinished line first.
+        '''
+
+        self.normalize = re.compile(pattern) if pattern else None
+        self.times = '\u00d7' if renderer is None or renderer.render('\u00d7') == '\u00d7' else 'x'
+        self.inPlace = inPlace
+        self.lastKey = None         # Normalized form of the line that started the current run
+        self.count = 0              # Number of lines in the current run
+        self.shownCount = 0         # Count last written for the current run by flush(), or 0 if not written
+        self.partial = ''           # Incomplete last line, held back until we know whether it repeats the current run
+        self.partialShown = False   # Whether the incomplete last line has already been written out
+
+    def key(self, line):
+        '''Return the normalized form of a line, used to compare it with the other lines in the run.'''
+
+        return self.normalize.sub('', line) if self.normalize else line
+
+    def feed(self, text):
+        '''Return the text to be written in place of the next chunk of text, which may end part-way through a line.'''
+
+        parts = []
+        start = 0
+        while start < len(text):
+            end = text.find('\n', start) + 1
+            if not end:
+                self.addPartial(text[start:], parts)
+                break
+            self.addLine(text[start:end], parts)
+            start = end
+        return ''.join(parts)
+
+    def holding(self):
+        '''Return True if there is output waiting to be written, either a held-back line, or a new count for the current run.'''
+
+        return (self.count > 1 and self.count != self.shownCount) or bool(self.partial and not self.partialShown)
+
+    def flush(self):
+        '''Return all the output being held back, without ending the current run unless a held-back line must be written.'''
+
+        global unfinishedLine
+
+        parts = []
+        if self.partial and not self.partialShown:
+            self.endRun(parts)
+            parts.append(self.partial)
+            self.partialShown = True
+        elif self.count > 1 and self.count != self.shownCount:
+            if not self.inPlace:
+                parts.append('[{}{}]\n'.format(self.times, self.count))
+            else:
+                # Overwrite the count written last time, unless tPrint() has since ended its line
+                parts.append(('\r' if self.shownCount and unfinishedLine is self else '') + '[{}{}]'.format(self.times, self.count))
+                unfinishedLine = self
+            self.shownCount = self.count
+        return ''.join(parts)
+
+    def finish(self):
+        '''Return all the output being held back, ending the current run, e.g. at the end of a log file.'''
+
+        parts = []
+        self.endRun(parts)
+        if self.partial and not self.partialShown:
+            parts.append(self.partial)
+            self.partialShown = True
+        return ''.join(parts)
+
+    def addLine(self, segment, parts):
+        '''Add the segment completing the current line, either writing the line, or counting it as part of the current run.'''
+
+        line = self.partial + segment
+        if self.partialShown:
+            # The start of the line was already written, so it can only start a new run
+            parts.append(segment)
+            self.lastKey, self.count = self.key(line), 1
+        else:
+            key = self.key(line)
+            if key == self.lastKey:
+                self.count += 1
+            else:
+                self.endRun(parts)
+                parts.append(line)
+                self.lastKey, self.count = key, 1
+        self.partial = ''
+        self.partialShown = False
+
+    def addPartial(self, segment, parts):
+        '''Add a segment that does not complete the current line.'''
+
+        self.partial += segment
+        if self.partialShown:
+            parts.append(segment)
+
+        # Hold back the incomplete line only for as long as it could still turn out to be a repeat of the current run
+        elif self.lastKey is None or not self.lastKey.startswith(self.key(self.partial)):
+            self.endRun(parts)
+            parts.append(self.partial)
+            self.partialShown = True
+
+    def endRun(self, parts):
+        '''End the current run, writing the count of its lines if it was repeated.'''
+
+        global unfinishedLine
+
+        if self.shownCount and unfinishedLine is self:
+            # Finish the unfinished "[×N]" line written by flush(), updating it if there have been more repeats since
+            parts.append('\r[{}{}]\n'.format(self.times, self.count) if self.count != self.shownCount else '\n')
+            unfinishedLine = None
+        elif self.count > 1 and self.count != self.shownCount:
+            parts.append('[{}{}]\n'.format(self.times, self.count))
+        self.lastKey = None
+        self.count = 0
+        self.shownCount = 0
+
+
 class LogWriter():
     '''Logging functions.'''
 
-    def __init__(self, logFile):
-        '''Open the specified file for output logging.'''
+    def __init__(self, logFile, compactFile=None, pattern=None):
+        '''Open the specified file for output logging, and the specified file for compact logging.
+
+        The compact log has each run of repeated lines collapsed into a single record, using the (optional) normalizing regex pattern.
+        '''
 
         self.logFile = logFile
-        self.logFd = None
+        self.logFd = self.open(logFile)
+
+        self.compactFile = compactFile
+        self.compactFd = self.open(compactFile)
+        if self.compactFd:
+            # The compact log works on lines of text, so must decode UTF-8 that may be split across writes
+            self.decoder = codecs.getincrementaldecoder('utf-8')(errors='backslashreplace')
+            self.collapser = LineCollapser(pattern)
+
+    def open(self, fileName):
+        '''Open a log file, if specified, returning None if it can't be opened.'''
 
         try:
-            if self.logFile:
-                self.logFd = open(self.logFile, 'wb')
+            if fileName:
+                return open(fileName, 'wb')
         except Exception as e:
-            print("{}\n\nroky: Unable to open log file {}\n".format(e, self.logFile))
-            self.logFd = None
+            print("{}\n\nroky: Unable to open log file {}\n".format(e, fileName))
+        return None
 
     def write(self, bytesIn):
-        '''Write the data to the log file if it is open.'''
+        '''Write the data to the log files that are open.'''
 
         if self.logFd:
             try:
@@ -309,73 +737,483 @@ class LogWriter():
                 # Make sure we don't keep trying to write to the log file if something went wrong
                 self.logFd = None
 
+        if self.compactFd:
+            self.writeCompact(self.collapser.feed(self.decoder.decode(bytesIn)))
+
+    def writeCompact(self, text):
+        '''Write collapsed text to the compact log file.'''
+
+        try:
+            self.compactFd.write(text.encode())
+            self.compactFd.flush()
+        except Exception as e:
+            print("\n{}\n\nroky: Unable to write to log file: {}\n".format(e, self.compactFile))
+            self.compactFd = None
+
     def close(self):
-        '''Close the log file.'''
+        '''Close the log files.'''
 
         if self.logFd:
             self.logFd.close()
             self.logFd = None
 
+        if self.compactFd:
+            # Write out the last run of repeated lines
+            self.writeCompact(self.collapser.feed(self.decoder.decode(b'', final=True)) + self.collapser.finish())
+            if self.compactFd:
+                self.compactFd.close()
+                self.compactFd = None
+
 
-def consoleFormat(bytesIn):
-    '''Take an aritrary byte string that 'should' contain valid UTF-8, formatting it for display on the Windows console.'''
+# A single chanperf sample: arrival time, memory usage (KiB), and CPU usage (%)
+PerfSample = collections.namedtuple('PerfSample', 'time mem anon file shared swap cpu user sys')
 
-    # Return a character string that can be printed on the user's console window, assuming a Consolas font is being used
-    consoleChars = ''
+# chanperf output looks like: channel: mem=31500KiB{anon=19736,file=11424,shared=340,swap=0},%cpu=5{user=3,sys=2}
+reChanperfMem = re.compile(r'mem=(\d+)KiB\{anon=(\d+),file=(\d+),shared=(\d+),swap=(\d+)\}')
+reChanperfCpu = re.compile(r'%cpu=(\d+)\{user=(\d+),sys=(\d+)\}')
+
+def parseChanperf(line, stamp):
+    '''Return the PerfSample contained in a line of chanperf output, or None if the line is not a chanperf sample.'''
+
+    mem = reChanperfMem.search(line)
+    cpu = reChanperfCpu.search(line)
+    if not mem or not cpu:
+        return None
+    return PerfSample(stamp, *(int(value) for value in mem.groups() + cpu.groups()))
+
+
+class PerfWriter():
+    '''Append chanperf samples to a compact, binary time-series file.'''
+
+    MAGIC = b'ROKYPERF'                     # Written at the start of a new time-series file
+    RECORD = struct.Struct('<dIIIIIHHH')    # Fixed-size little-endian record for each PerfSample
+
+    def __init__(self, perfFile):
+        '''Open the specified time-series file, appending to any samples it already holds.'''
+
+        self.perfFile = perfFile
+        self.perfFd = None
+
+        try:
+            if self.perfFile:
+                self.perfFd = open(self.perfFile, 'ab')
+                if self.perfFd.tell() == 0:
+                    self.perfFd.write(PerfWriter.MAGIC)
+        except Exception as e:
+            print("{}\n\nroky: Unable to open chanperf file {}\n".format(e, self.perfFile))
+            self.perfFd = None
+
+    def write(self, sample):
+        '''Append a sample to the time-series file if it is open.'''
+
+        if self.perfFd:
+            try:
+                # CPU percentages are stored in 16 bits, and can't legitimately come anywhere near that limit
+                self.perfFd.write(PerfWriter.RECORD.pack(*sample[:6] + tuple(min(value, 0xFFFF) for value in sample[6:])))
+                self.perfFd.flush()
+            except Exception as e:
+                tPrint("\n{}\n\nroky: Unable to write to chanperf file: {}\n".format(e, self.perfFile))
+                self.perfFd = None
+
+    def close(self):
+        '''Close the time-series file.'''
+
+        if self.perfFd:
+            self.perfFd.close()
+            self.perfFd = None
+
+
+def readPerfFile(perfFile):
+    '''Generate the PerfSamples stored in a time-series file written by PerfWriter.'''
+
+    with open(perfFile, 'rb') as f:
+        if f.read(len(PerfWriter.MAGIC)) != PerfWriter.MAGIC:
+            raise ValueError("{} is not a roky chanperf file".format(perfFile))
+        while True:
+            record = f.read(PerfWriter.RECORD.size)
+            if len(record) < PerfWriter.RECORD.size:
+                break
+            yield PerfSample(*PerfWriter.RECORD.unpack(record))
+
+
+def perfSummary(sample, first):
+    '''Return a one-line summary of a chanperf sample, including the memory growth since the first sample.'''
+
+    return "roky: cpu {}% (user {}%, sys {}%)  mem {} KiB ({:+} KiB)  anon {} KiB  swap {} KiB".format(
+        sample.cpu, sample.user, sample.sys, sample.mem, sample.mem - first.mem, sample.anon, sample.swap)
+
+
+def escapeChar(cp):
+    '''Return the backslash-escaped form of a Unicode code point: "\\xhh", "\\uhhhh", or a UTF-16 surrogate pair "\\uhhhh\\uhhhh".'''
+
+    # Code points 0-x7F (0-127) are ASCII
+    if cp < 0x80:
+        return "\\x{:02x}".format(cp)
+
+    # Code points up to xFFFF are in the Unicode Basic Multilingual Plane, occupying 16 bits
+    elif cp < 0x10000:
+        return "\\u{:04x}".format(cp)
+
+    # Valid Unicode code points from x10000 to x10FFFF are represented by a UTF-16 surrogate-pair
+    elif cp < 0x110000:
+        # If you don't understand any of the following, take a look at: https://www.ietf.org/rfc/rfc2781.txt sec 2.1
+        bt20 = cp - 0x10000
+        hi10 = (((bt20 & 0xFFC00) >> 10) & 0x3FF) + 0xD800
+        lo10 = (bt20 & 0x3FF) + 0xDC00
+        return "\\u{:04x}\\u{:04x}".format(hi10, lo10)
+
+    # Code points above 10FFFF are invalid - We shouldn't get here if decode() works correctly
+    else:
+        return '\ufffd'   # Just use the Unicode Replacement Character
+
+
+class EscapeTable(dict):
+    '''str.translate() table mapping each code point to itself if it can be displayed, or to its escaped form if not.
+
+    Entries are added the first time each code point is looked up, so the table only holds the code points actually seen.
+    '''
+
+    def __init__(self, escapeRe):
+        '''Code points matching the compiled regex escapeRe are escaped.'''
+
+        super().__init__()
+        self.escapeRe = escapeRe
+
+    def __missing__(self, cp):
+        value = escapeChar(cp) if self.escapeRe.match(chr(cp)) else cp
+        self[cp] = value
+        return value
+
+
+class Renderer():
+    '''Format decoded debugger output for a kind of terminal, escaping any characters it can't display.'''
+
+    def __init__(self, name, displayable):
+        '''Compile the renderer from a regex character set (without the brackets) of the characters the terminal can display.'''
+
+        self.name = name
+        self.escapeRe = re.compile('[^' + displayable + ']')
+        self.table = EscapeTable(self.escapeRe)
+
+    def render(self, text):
+        '''Return the text, with each character the terminal can't display backslash-escaped.'''
+
+        # Most output needs no escaping at all, which is quicker to check than to translate
+        if not self.escapeRe.search(text):
+            return text
+        return text.translate(self.table)
+
+
+# Renderer profiles, selected using the -u command-line option, or automatically by detectRenderer().
+# Printable ASCII characters are always output as-is (including TAB, CR and LF). The rest of ASCII is hex backslash-escaped.
+# Unfortunately, the Roku won't output several of the ASCII control codes, outputting question marks or spaces instead.
+RENDERERS = {
+    # The classic Windows console, which displays code points up to x0513 (1299) when using the Consolas font,
+    # the highest value handled by that font.
+    'legacy':   Renderer('legacy', '\t\n\r -~\x80-\u0513'),
+    # Terminals that can display all of Unicode, e.g. Windows Terminal or mintty. Only control characters are escaped.
+    'unicode':  Renderer('unicode', '\t\n\r -~\xa0-\U0010ffff'),
+    # Pipes and files that may only handle ASCII.
+    'ascii':    Renderer('ascii', '\t\n\r -~'),
+    }
+
+def detectRenderer(console):
+    '''Choose the renderer profile best suited to the terminal that the debugger output is written to.'''
+
+    # Windows Terminal sets WT_SESSION, and can display all of Unicode; the classic Windows console is limited by its font
+    if console.console:
+        return RENDERERS['unicode'] if os.environ.get('WT_SESSION') else RENDERERS['legacy']
+
+    # MinGW's mintty can display all of Unicode, even though Windows Python sees it as a pipe
+    if console.mintty:
+        return RENDERERS['unicode']
+
+    # Output that is piped or redirected elsewhere may only handle ASCII
+    if not sys.stdout.isatty():
+        return RENDERERS['ascii']
+
+    # Other terminals set TERM, and can display all of Unicode unless it's a dumb terminal
+    return RENDERERS['ascii'] if os.environ.get('TERM', 'dumb') == 'dumb' else RENDERERS['unicode']
+
+
+def consoleFormat(bytesIn, renderer=None):
+    '''Take an aritrary byte string that 'should' contain valid UTF-8, formatting it for display by the renderer (legacy by default).'''
 
     # Do our best to output valid UTF-8 code points
     try:
         # Decode the bytes received from the Roku.
         # Use 'backslashreplace' for invalid characters so the user can see the character values of the invalid data.
-        decodedChars = bytesIn.decode(errors='backslashreplace')
-
-        # Print all code-points "as is" up to 0x513, the highest value handled by the Consolas font.
-        # If the code point corresponds to a Unicode surrogate pair, then print the pair as a UTF-16 hex pair: "\uhhhh\uhhhh".
-        # If the code point is above the max allowable Unicode code point (shouldn't happen), print a Unicode Replacement Character.
-        for c in decodedChars:
-
-            # Get the numeric value of the character (Unicode code point number)
-            cp = ord(c)
-
-            # Code points 0-x7F (0-127) are supported by the Windows console
-            if cp < 0x80:
-                # Print the character "as is" if it's a printable character, otherwise backslash-escape as \xhh
-                # In practice, most of the non-printable ASCII characters are output as "?" or space by Roku.
-                if printable [cp] == 1:
-                    consoleChars += c
-                else:
-                    consoleChars += "\\x{:02x}".format(cp)
-
-            # Code points from x0080 to x0513 (128-1299) are output correctly by the Roku and can be displayed by the Windows console,
-            # at least when using the Consolas font, which supports the first 1300 Unicode characters.
-            elif cp <= 0x0513:
-                consoleChars += c
-
-            # Code points up to xFFFF are in the Unicode Basic Multilingual Plane, occupying 16 bits
-            elif cp < 0x10000:
-                # Print the unicode-escaped value of the code point: "\uhhhh"
-                consoleChars += "\\u{:04x}".format(cp)
-
-            # Valid Unicode code points from x10000 to x10FFFF are represented by a UTF-16 surrogate-pair
-            elif cp < 0x110000:
-                # If you don't understand any of the following, take a look at: https://www.ietf.org/rfc/rfc2781.txt sec 2.1
-                bt20 = cp - 0x10000
-                hi10 = (((bt20 & 0xFFC00) >> 10) & 0x3FF) + 0xD800
-                lo10 = (bt20 & 0x3FF) + 0xDC00
-                consoleChars += "\\u{:04x}\\u{:04x}".format(hi10, lo10)
-
-            # Code points above 10FFFF are invalid - We shouldn't get here if decode() works correctly
-            else:
-                consoleChars += '\ufffd'   # Just use the Unicode Replacement Character
-
+        return (renderer or RENDERERS['legacy']).render(bytesIn.decode(errors='backslashreplace'))
     except:
         # Shouldn't get here, as decode() is supposed to replace invalid Unicode, not throw an exception
-        consoleChars = '**** Unicode Decode Error ****'
-    return consoleChars
+        return '**** Unicode Decode Error ****'
+
+
+def portLogFile(logFile, port):
+    '''Derive the name of a per-port log file from the main log file name, e.g. roky.log => roky-8085.log.'''
+
+    if not logFile:
+        return None
+    root, ext = os.path.splitext(logFile)
+    return '{}-{}{}'.format(root, port, ext)
+
+
+class LineTagger():
+    '''Prefix each line of a stream made up of chunks from several sources with a tag identifying its source.'''
+
+    def __init__(self, newline):
+        '''Tag either character strings or byte strings, depending on the type of newline.'''
+
+        self.newline = newline
+        self.lastSource = None
+        self.atLineStart = True
+
+    def tag(self, chunk, source, prefix):
+        '''Return the chunk with prefix inserted at the start of each of its lines.'''
+
+        parts = []
+
+        # If another source was part-way through a line, end that line so this source's output starts on a line of its own
+        if source != self.lastSource and not self.atLineStart:
+            parts.append(self.newline)
+            self.atLineStart = True
+        self.lastSource = source
+
+        start = 0
+        while start < len(chunk):
+            end = chunk.find(self.newline, start) + 1 or len(chunk)
+            if self.atLineStart:
+                parts.append(prefix)
+            parts.append(chunk[start:end])
+            self.atLineStart = chunk[end - 1:end] == self.newline
+            start = end
+
+        return chunk[:0].join(parts)
+
+
+class Timeline():
+    '''Merge the output from several Roku debug ports into a single, time-ordered view and log.'''
+
+    # Hold each chunk for this many seconds before writing it, so that a chunk stamped slightly earlier
+    # by another port's reader thread, but queued later, can still be written ahead of it.
+    REORDER_WINDOW = 0.05
+
+    def __init__(self, console, log):
+        '''Write the merged output to the console, and to the merged log file (which may not be open).'''
+
+        self.console = console
+        self.log = log
+        self.q = queue.Queue()
+        self.seq = itertools.count()    # Keeps chunks with identical time stamps in arrival order
+        self.consoleTagger = LineTagger('\n')
+        self.logTagger = LineTagger(b'\n')
+
+    def put(self, stamp, port, bytesIn, text):
+        '''Queue a chunk received from a Roku port at time stamp, as raw bytes for the log and formatted text for the console.
+
+        User input sent to a Roku port is queued with empty text, as it has already been echoed to the console.
+        '''
+
+        self.q.put((stamp, next(self.seq), port, bytesIn, text))
+
+    def write(self, stamp, seq, port, bytesIn, text):
+        '''Write a chunk to the console and the merged log, each line tagged with the port it came from.'''
+
+        if text:
+            self.console.write(self.consoleTagger.tag(text, port, '[{}] '.format(port)))
+
+        # The log also records the arrival time of each line, to the nearest millisecond
+        logPrefix = '{}.{:03d} [{}] '.format(time.strftime('%H:%M:%S', time.localtime(stamp)), int(stamp % 1 * 1000), port)
+        self.log.write(self.logTagger.tag(bytesIn, port, logPrefix.encode()))
+
+
+class SourceIndex():
+    '''Index of the .brs and .xml files in a local channel source tree: the offset of each line, and the function definitions.
 
+    The index is built in the background, and cached between sessions in the ~/.roky directory.
+    A file is only read again if its modification time or size has changed, and only re-parsed if its content hash has changed.
+    '''
 
-def rokuReaderThread(rokuSocket, console, quitQ, log):
-    '''Within the main process, receive debugger output from the Roku, writing it to the console and the log file.'''
+    EXTENSIONS = ('.brs', '.xml')
+    VERSION = 2             # Changed whenever the format of the index entries changes, so older cached indexes are ignored
+    reFunction = re.compile(br'^[ \t]*(?:function|sub)[ \t]+(\w+)[ \t]*\(', re.IGNORECASE | re.MULTILINE)
+    reFunctionEnd = re.compile(br'^[ \t]*end[ \t]*(?:function|sub)\b', re.IGNORECASE | re.MULTILINE)
+
+    def __init__(self, srcDir):
+        '''Use the channel source tree in srcDir, the directory that gets zipped up and side-loaded.'''
+
+        self.srcDir = os.path.abspath(srcDir)
+        self.cacheFile = os.path.join(os.path.expanduser('~'), '.roky',
+                                      'index{}-{}.json'.format(SourceIndex.VERSION,
+                                                               hashlib.sha1(self.srcDir.encode()).hexdigest()[:16]))
+        self.files = {}         # Index entry for each file, keyed by its lower-case pkg:/ path
+        self.ready = False      # Lookups find nothing until the index has been built
+
+    def start(self):
+        '''Start building the index in the background, so as not to delay startup.'''
+
+        threading.Thread(target=self.build, daemon=True).start()
+        return self
+
+    def build(self):
+        '''Index every source file, reusing the cached index entries for files that haven't changed.'''
+
+        try:
+            with open(self.cacheFile) as f:
+                cached = json.load(f)
+        except Exception:
+            cached = {}
+
+        files = {}
+        for root, dirs, names in os.walk(self.srcDir):
+            for name in names:
+                if name.lower().endswith(SourceIndex.EXTENSIONS):
+                    path = os.path.relpath(os.path.join(root, name), self.srcDir).replace(os.sep, '/')
+                    try:
+                        files[path.lower()] = self.indexFile(path, cached.get(path.lower()))
+                    except OSError:
+                        pass
+        self.files = files
+        self.ready = True
+
+        try:
+            os.makedirs(os.path.dirname(self.cacheFile), exist_ok=True)
+            with open(self.cacheFile, 'w') as f:
+                json.dump(files, f)
+        except Exception as e:
+            tPrint("\n{}\n\nroky: Unable to save source index to {}\n".format(e, self.cacheFile))
+
+    def indexFile(self, path, entry):
+        '''Return the index entry for a file, given its path within the source tree and its previous entry (if any).'''
+
+        fullPath = os.path.join(self.srcDir, path)
+        st = os.stat(fullPath)
+        if entry and entry['mtime'] == st.st_mtime and entry['size'] == st.st_size:
+            return entry
+
+        with open(fullPath, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha1(data).hexdigest()
+        if entry and entry['hash'] == digest:
+            return dict(entry, mtime=st.st_mtime, size=st.st_size)
+
+        # Byte offset of the start of each line, with a final offset for the end of the last line
+        lines = [0] + [match.end() for match in re.finditer(b'\n', data)]
+        if lines[-1] < len(data):
+            lines.append(len(data))
+
+        # Line number, name, and end line number of each function or sub definition, in line number order
+        ends = [bisect.bisect_right(lines, match.start()) for match in SourceIndex.reFunctionEnd.finditer(data)]
+        functions = []
+        for match in SourceIndex.reFunction.finditer(data):
+            start = bisect.bisect_right(lines, match.start())
+            i = bisect.bisect_left(ends, start)
+            functions.append([start, match.group(1).decode(), ends[i] if i < len(ends) else len(lines) - 1])
+
+        return {'path': path, 'mtime': st.st_mtime, 'size': st.st_size, 'hash': digest, 'lines': lines, 'functions': functions}
+
+    def lookup(self, pkgPath, lineNumber):
+        '''Return the file path, enclosing function name (or None), and source code for a pkg:/ path and line, or None.'''
+
+        key = pkgPath.lower()
+        entry = self.files.get(key)
+        if not entry:
+            return None
+
+        try:
+            # Pick up any changes made to the file since the index was built
+            entry = self.files[key] = self.indexFile(entry['path'], entry)
+            lines = entry['lines']
+            if not 0 < lineNumber < len(lines):
+                return None
+            with open(os.path.join(self.srcDir, entry['path']), 'rb') as f:
+                f.seek(lines[lineNumber - 1])
+                code = f.read(lines[lineNumber] - lines[lineNumber - 1])
+        except OSError:
+            return None
+
+        # The last function defined at or before the line, if the line comes before that function's end.
+        # The sentinel name sorts after any function name on the same line.
+        functions = entry['functions']
+        i = bisect.bisect_right(functions, [lineNumber, '\U0010ffff'])
+        function = functions[i - 1][1] if i and lineNumber <= functions[i - 1][2] else None
+
+        return entry['path'], function, code.decode(errors='replace').strip()
+
+
+class SourceAnnotator():
+    '''Annotate each line of debugger output that refers to a pkg:/file(line), e.g. a backtrace frame, with that source line.'''
+
+    reSourceRef = re.compile(r'pkg:/([^\s()]+)\((\d+)\)')
+
+    def __init__(self, index, renderer=None):
+        '''Look up source lines in the SourceIndex, formatting them for display using the renderer (legacy by default).'''
+
+        self.index = index
+        self.renderer = renderer or RENDERERS['legacy']
+        self.partial = ''       # Incomplete last line, only needed if it contains a source reference
+
+    def feed(self, text):
+        '''Return the next chunk of text, which may end part-way through a line, with annotations after any complete lines.'''
+
+        # Most output has no source references at all, so just keep track of the incomplete last line.
+        # Include the end of the incomplete line, in case the chunk starts part-way through a 'pkg:/'.
+        if 'pkg:/' not in self.partial[-4:] + text and 'pkg:/' not in self.partial:
+            end = text.rfind('\n') + 1
+            self.partial = text[end:] if end else (self.partial + text)[-1024:]
+            return text
+
+        parts = []
+        start = 0
+        while True:
+            end = text.find('\n', start) + 1
+            if not end:
+                break
+            parts.append(text[start:end])
+            parts.extend(self.annotate(self.partial + text[start:end]))
+            self.partial = ''
+            start = end
+        parts.append(text[start:])
+        self.partial = (self.partial + text[start:])[-1024:]
+        return ''.join(parts)
+
+    def annotate(self, line):
+        '''Return the annotation lines for each distinct source reference in a line of output.'''
+
+        annotations = []
+        if self.index.ready:
+            refs = []
+            for ref in SourceAnnotator.reSourceRef.findall(line):
+                if ref not in refs:
+                    refs.append(ref)
+            for pkgPath, lineNumber in refs:
+                found = self.index.lookup(pkgPath, int(lineNumber))
+                if found:
+                    path, function, code = found
+                    annotations.append(self.renderer.render('    >> {}({}){}: {}\n'.format(
+                        path, lineNumber, ' in ' + function if function else '', code)))
+        return annotations
+
+
+def rokuReaderThread(rokuSocket, console, quitQ, log, port=None, timeline=None, collapser=None, renderer=None,
+                     annotator=None):
+    '''Within the main process, receive debugger output from the Roku, writing it to the console and the log file.
+
+    When several Roku ports are being captured, the output is passed to the timeline instead of being written to the console.
+    If a line collapser is specified, runs of repeated lines are collapsed before being written.
+    The output is formatted for display using the specified renderer profile (legacy by default).
+    If a source annotator is specified, lines referring to source files are followed by the source lines they refer to.
+    '''
+
+    def display(stamp, bytesIn, text):
+        '''Write the formatted text to the console, or pass it to the timeline along with the bytes it came from.'''
+
+        if annotator:
+            text = annotator.feed(text)
+        if timeline:
+            timeline.put(stamp, port, bytesIn, text)
+        elif text:
+            console.write(text)
 
     quitMsg = ''
 
@@ -386,69 +1224,93 @@ def rokuReaderThread(rokuSocket, console, quitQ, log):
     # which happens to have been split at the end of the packet.
     trail = b''
 
+    # Profiler generation this thread last checked
+    profiled = profiler.checkpoint()
+
     # This thread runs as a daemon thread that will be terminated when the program ends
     while True:
         # Read the data from the Roku using this (blocking) socket
         try:
+            # If the line collapser is holding back output, don't let it wait indefinitely for more data to arrive
+            if collapser and collapser.holding():
+                if not select.select([rokuSocket], [], [], LineCollapser.IDLE_FLUSH)[0]:
+                    display(time.time(), b'', collapser.flush())
+                    continue
+
             # Raw bytes (hopefully valid UTF-8) come in from the Roku
             bytesIn = rokuSocket.recv(4096)
 
-            # Include any trailing UTF-8 characters that begun in the previous socket recv
-            if trail:
-                bytesIn = trail + bytesIn
-                trail = b''      # Must reset so we can detect trailing split UTF-8 at end of current packet
+            # Note the time of arrival, used to merge the output from several Roku ports into a single timeline
+            stamp = time.time()
         except Exception as e:
             quitMsg = "\n{}\n\nroky: Roku reader thread unable to receive data from Roku socket".format(e)
             break
 
-        if bytesIn:
-            # Log the data without decoding the input bytes.
-            # The log file was opened in binary mode, so it doesn't care what format the Roku data is.
-            log.write(bytesIn)
-
-            # Count the number of UTF-8 continuation bytes at the end of the input byte stream
-            i = len(bytesIn)
-            while (i > 0) and ((bytesIn[i - 1] >> 6) == 0b10):  # All UTF-8 continuation bytes are in the form: 10xxxxxx
-                i -= 1
-            nCont = len(bytesIn) - i
-
-            # Get the last non-continuation byte (if i = 0 then bytesIn starts with a continuation
-            # character, which should not happen, but if it does just treat the whole packet as a trailing sequence)
-            expectedCont = 0
-            if i > 0:
-                leadByte = bytesIn[i - 1]
-                # Determine the expected number of continuation bytes based on the lead byte's bit pattern
-                if (leadByte >> 5) == 0b110:
-                    expectedCont = 1
-                elif (leadByte >> 4) == 0b1110:
-                    expectedCont = 2
-                elif (leadByte >> 3) == 0b11110:
-                    expectedCont = 3
-                else:
-                    pass
-                # Check if this packet ends in a partial UTF-8 byte sequence
-                if nCont < expectedCont:
-                    # Extract the partial continuation sequence
-                    trail = bytesIn[i - 1:]
-                    # Strip off the partial continuation sequence
-                    bytesIn = bytesIn[:i - 1]
+        # Start or stop profiling this thread if profiling has been turned on or off since the last pass
+        if profiler.generation != profiled:
+            profiled = profiler.checkpoint()
+
+        # An empty receive means the Roku has closed the connection; receiving again would just return nothing forever
+        if not bytesIn:
+            quitMsg = "\n\nroky: Roku closed the connection"
+            break
+
+        # Log the data without decoding the input bytes.
+        # The log file was opened in binary mode, so it doesn't care what format the Roku data is.
+        log.write(bytesIn)
+
+        # Include any trailing UTF-8 characters that begun in the previous socket recv.
+        # These were logged along with the previous packet, so are only added back after logging the current packet.
+        if trail:
+            bytesIn = trail + bytesIn
+            trail = b''      # Must reset so we can detect trailing split UTF-8 at end of current packet
+
+        # Count the number of UTF-8 continuation bytes at the end of the input byte stream
+        i = len(bytesIn)
+        while (i > 0) and ((bytesIn[i - 1] >> 6) == 0b10):  # All UTF-8 continuation bytes are in the form: 10xxxxxx
+            i -= 1
+        nCont = len(bytesIn) - i
+
+        # Get the last non-continuation byte (if i = 0 then bytesIn starts with a continuation
+        # character, which should not happen, but if it does just treat the whole packet as a trailing sequence)
+        expectedCont = 0
+        if i > 0:
+            leadByte = bytesIn[i - 1]
+            # Determine the expected number of continuation bytes based on the lead byte's bit pattern
+            if (leadByte >> 5) == 0b110:
+                expectedCont = 1
+            elif (leadByte >> 4) == 0b1110:
+                expectedCont = 2
+            elif (leadByte >> 3) == 0b11110:
+                expectedCont = 3
             else:
-                trail = bytesIn
-                bytesIn = b''
+                pass
+            # Check if this packet ends in a partial UTF-8 byte sequence
+            if nCont < expectedCont:
+                # Extract the partial continuation sequence
+                trail = bytesIn[i - 1:]
+                # Strip off the partial continuation sequence
+                bytesIn = bytesIn[:i - 1]
+        else:
+            trail = bytesIn
+            bytesIn = b''
 
-            # For example, roky can be used on port 8080 to run genkey, which outputs a single character at a time.
-            try:
-                # Decode the Roku bytes and write to the console using the native Windows API, if possible
-                console.write (consoleFormat (bytesIn))
-
-            # Hopefully, the user's console can handle the UTF-8 data to be displayed.
-            # If not, a UnicodeEncodeError may be raised by the console charmap handler.
-            # Attempt to continue if we get a Unicode exception.
-            except UnicodeEncodeError as e:
-                tPrint("\n{}\n\nroky: Roku reader thread unable to print UTF-8 data to console window\n".format(e))
-            except Exception as e:
-                quitMsg = "\n{}\n\nroky: Roku reader thread unable to write to windows console".format(e)
-                break
+        # For example, roky can be used on port 8080 to run genkey, which outputs a single character at a time.
+        try:
+            # Decode the Roku bytes and write to the console using the native Windows API, if possible
+            text = consoleFormat (bytesIn, renderer)
+            if collapser:
+                text = collapser.feed(text)
+            display(stamp, bytesIn, text)
+
+        # Hopefully, the user's console can handle the UTF-8 data to be displayed.
+        # If not, a UnicodeEncodeError may be raised by the console charmap handler.
+        # Attempt to continue if we get a Unicode exception.
+        except UnicodeEncodeError as e:
+            tPrint("\n{}\n\nroky: Roku reader thread unable to print UTF-8 data to console window\n".format(e))
+        except Exception as e:
+            quitMsg = "\n{}\n\nroky: Roku reader thread unable to write to windows console".format(e)
+            break
 
     # If we get this far, something went wrong, so signal the main thread that we are dying
     # Note - it's better to have the main thread print the error, since this thread is a daemon, and
@@ -456,15 +1318,135 @@ def rokuReaderThread(rokuSocket, console, quitQ, log):
     quitQ.put(quitMsg)
 
 
+def timelineThread(timeline, quitQ):
+    '''Within the main process, write the output queued by the Roku reader threads to the console and merged log, in time order.'''
+
+    quitMsg = ''
+
+    # Chunks waiting out the timeline's reorder window, ordered by arrival time stamp
+    pending = []
+
+    # Profiler generation this thread last checked
+    profiled = profiler.checkpoint()
+
+    # This thread runs as a daemon thread that will be terminated when the program ends
+    while True:
+        # Wait for the next chunk, but no longer than it takes for the earliest pending chunk to become due
+        timeout = None
+        if pending:
+            timeout = max(0, pending[0][0] + Timeline.REORDER_WINDOW - time.time())
+        try:
+            heapq.heappush(pending, timeline.q.get(timeout=timeout))
+        except queue.Empty:
+            pass
+
+        # Start or stop profiling this thread if profiling has been turned on or off since the last pass
+        if profiler.generation != profiled:
+            profiled = profiler.checkpoint()
+
+        # Write out every chunk that has been held for the full reorder window
+        try:
+            now = time.time()
+            while pending and pending[0][0] + Timeline.REORDER_WINDOW <= now:
+                timeline.write(*heapq.heappop(pending))
+        except UnicodeEncodeError as e:
+            tPrint("\n{}\n\nroky: Timeline thread unable to print UTF-8 data to console window\n".format(e))
+        except Exception as e:
+            quitMsg = "\n{}\n\nroky: Timeline thread unable to write to windows console".format(e)
+            break
+
+    # If we get this far, something went wrong, so signal the main thread that we are dying
+    quitQ.put(quitMsg)
+
+
+def perfSamplerThread(host, interval, console, perfWriter):
+    '''Within the main process, sample the channel's CPU and memory usage by issuing chanperf commands on its own Roku connection.'''
+
+    # Use a separate connection so the sampler never holds up the Roku reader threads.
+    # Failing to sample is not fatal, so the debug session continues regardless.
+    try:
+        perfSocket = socket.create_connection((host, PERF_PORT))
+    except Exception as e:
+        tPrint("\n{}\n\nroky: chanperf sampler unable to connect to Roku socket at {}:{}".format(e, host, PERF_PORT))
+        return
+
+    # Incomplete line of chanperf output, continued in the next socket recv
+    buf = b''
+
+    # The first sample, used to show memory growth over the session
+    first = None
+
+    # If the summary can't be shown in the console's title, it is printed every PERF_PRINT seconds instead
+    nextPrint = None
+
+    # Profiler generation this thread last checked
+    profiled = profiler.checkpoint()
+
+    nextPoll = 0
+    try:
+        while True:
+            # Start or stop profiling this thread if profiling has been turned on or off since the last pass
+            if profiler.generation != profiled:
+                profiled = profiler.checkpoint()
+
+            # Issue a single chanperf command each interval; the Roku does very little work for each one
+            now = time.time()
+            if now >= nextPoll:
+                perfSocket.sendall(b'chanperf\r\n')
+                nextPoll = now + interval
+
+            # Wait for chanperf output, but no longer than the time until the next command is due
+            perfSocket.settimeout(max(nextPoll - time.time(), 0.01))
+            try:
+                bytesIn = perfSocket.recv(1024)
+            except socket.timeout:
+                continue
+            if not bytesIn:
+                raise ConnectionError("Roku closed the connection")
+
+            # Parse each complete line as it arrives, keeping any incomplete line for the next recv
+            lines = (buf + bytesIn).split(b'\n')
+            buf = lines.pop()
+            if len(buf) > 4096:
+                buf = b''   # Not chanperf output, which is much shorter
+            for line in lines:
+                sample = parseChanperf(line.decode(errors='replace'), time.time())
+                if sample:
+                    first = first or sample
+                    perfWriter.write(sample)
+                    if not console.setTitle(perfSummary(sample, first)):
+                        if nextPrint is None:
+                            tPrint("roky: Unable to show chanperf samples in the console title; printing them every {} seconds"
+                                   .format(PERF_PRINT))
+                            nextPrint = 0
+                        if sample.time >= nextPrint:
+                            tPrint(perfSummary(sample, first))
+                            nextPrint = sample.time + PERF_PRINT
+
+    except Exception as e:
+        tPrint("\n{}\n\nroky: chanperf sampler unable to communicate with Roku socket".format(e))
+    finally:
+        perfSocket.close()
+
+
 def rokuWriterThread(rokuSocket, rokuWriterQ, quitQ, log):
     '''Within the main process, send queued data to the Roku.'''
 
     quitMsg = ''
 
+    # Profiler generation this thread last checked
+    profiled = profiler.checkpoint()
+
     # This thread runs as a daemon thread that will be terminated when the program ends
     while True:
-        # Get data from the Roku write queue (blocking)
+        # Get data from the Roku write queue (blocking). None is queued when the connection is being closed.
         data = rokuWriterQ.get()
+        if data is None:
+            break
+
+        # Start or stop profiling this thread if profiling has been turned on or off since the last pass
+        if profiler.generation != profiled:
+            profiled = profiler.checkpoint()
 
         # Send data to the Roku (blocking)
         try:
@@ -483,8 +1465,11 @@ def rokuWriterThread(rokuSocket, rokuWriterQ, quitQ, log):
     quitQ.put(quitMsg)
 
 
-def consoleThread(sock, rokuWriterQ, quitQ, log):
-    ''' Within the main process, receive user's console input via a TCP socket connection with the child process.'''
+def consoleThread(sock, rokuWriterQ, quitQ, log, timeline=None, port=None):
+    ''' Within the main process, receive user's console input via a TCP socket connection with the child process.
+
+    When several Roku ports are being captured, the input is also logged in the timeline's merged log, tagged with the port.
+    '''
 
     reLines = re.compile(r'[^\r]*\r')   # findall() to get each line of user input, lines being terminated by \r characters
     reTrail = re.compile(r'[^\r]*\Z')   # search() to get any trailing user input data past the last \r character
@@ -498,6 +1483,9 @@ def consoleThread(sock, rokuWriterQ, quitQ, log):
         tPrint("\n{}\n\nroky: Console thread unable to accept client socket connection".format(e))
         return
 
+    # Profiler generation this thread last checked
+    profiled = profiler.checkpoint()
+
     # Process all data sent from the child process (user console input), writing data to the Roku
     try:
         charBuf = ''
@@ -505,6 +1493,10 @@ def consoleThread(sock, rokuWriterQ, quitQ, log):
             # We only need a small receive buffer, since the user's debug commands tend to be very short
             bytesIn = clientSock.recv(256)
 
+            # Start or stop profiling this thread if profiling has been turned on or off since the last pass
+            if profiler.generation != profiled:
+                profiled = profiler.checkpoint()
+
             # Since a blocking socket is used, when the client end of the socket is closed, 'None' will be returned when the socket closes
             if not bytesIn:
                 quitMsg = "\n\nroky: Console thread client socket data finished"
@@ -512,6 +1504,8 @@ def consoleThread(sock, rokuWriterQ, quitQ, log):
 
             # Log the data
             log.write(bytesIn + b'\n')
+            if timeline:
+                timeline.put(time.time(), port, bytesIn + b'\n', '')
 
             # Convert client's user input bytes into a character string
             charBuf += bytesIn.decode(errors='replace')
@@ -535,6 +1529,12 @@ def consoleThread(sock, rokuWriterQ, quitQ, log):
                     # Output the line to the console, stripping off the line terminator
                     tPrint(line.rstrip('\r'))
 
+                    # Handle 'roky profile' commands here, rather than sending them to the Roku
+                    words = line.split()
+                    if words[:2] == ['roky', 'profile']:
+                        tPrint(profiler.command(words[2:]))
+                        continue
+
                     # Write the line to the Roku device, ensuring it ends in \r (already in line) and \n (added)
                     rokuWriterQ.put_nowait(line.encode() + b'\n')
 
@@ -550,6 +1550,250 @@ def consoleThread(sock, rokuWriterQ, quitQ, log):
         quitQ.put(quitMsg)
 
 
+class SessionOutput():
+    '''Collect the output from a DebugSession's Roku reader thread, for both synchronous and asynchronous consumers.
+
+    The Roku reader and writer threads use this in place of both the console and the quit queue.
+    '''
+
+    MAX_CHUNKS = 10000          # Only the most recent chunks are kept for read() and async iteration
+    MAX_TEXT = 1 << 20          # Only the most recent output is kept for matching by expect() and waitFor()
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.chunks = collections.deque(maxlen=SessionOutput.MAX_CHUNKS)
+        self.text = ''          # Output that hasn't yet been consumed by a match
+        self.pending = []       # Chunks written since the last match was attempted, not yet joined on to text
+        self.pendingSize = 0    # Total length of the pending chunks
+        self.closed = False
+        self.quitMsg = ''
+        self.waiters = []       # (loop, asyncio.Event) for each coroutine waiting for output
+
+    def write(self, text):
+        '''Add a chunk of decoded output from the Roku reader thread.'''
+
+        with self.cond:
+            self.chunks.append(text)
+
+            # Joining up the output is left until a match is attempted, other than now and then to limit its size
+            self.pending.append(text)
+            self.pendingSize += len(text)
+            if self.pendingSize > 2 * SessionOutput.MAX_TEXT:
+                self.joinText()
+
+            self.notify()
+
+    def joinText(self):
+        '''Join the pending chunks on to the text to be matched, keeping only the most recent output.'''
+
+        if self.pending:
+            self.text = (self.text + ''.join(self.pending))[-SessionOutput.MAX_TEXT:]
+            self.pending = []
+            self.pendingSize = 0
+
+    def put(self, quitMsg):
+        '''Note that the Roku reader or writer thread has terminated, ending the output.'''
+
+        with self.cond:
+            if not self.closed:
+                self.closed = True
+                self.quitMsg = quitMsg
+            self.notify()
+
+    def notify(self):
+        '''Wake up all threads and coroutines waiting for output. Must be called holding the condition's lock.'''
+
+        self.cond.notify_all()
+        for loop, event in self.waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def nextChunk(self):
+        '''Return the next chunk of output, None if there isn't one yet, or raise EOFError if the output has ended.'''
+
+        if self.chunks:
+            return self.chunks.popleft()
+        if self.closed:
+            raise self.eof()
+        return None
+
+    def nextMatch(self, regex):
+        '''Return a match for the compiled regex, consuming the output up to its end, or None if there isn't one yet.'''
+
+        self.joinText()
+        match = regex.search(self.text)
+        if match:
+            self.text = self.text[match.end():]
+            return match
+        if self.closed:
+            raise self.eof()
+        return None
+
+    def eof(self):
+        '''Return the EOFError raised once the output has ended, giving the reason it ended if known.'''
+
+        return EOFError(self.quitMsg.strip() or "roky: Roku debugger connection closed")
+
+    def wait(self, get, timeout=None):
+        '''Block until get() returns something other than None, returning that, or raise TimeoutError.'''
+
+        deadline = None if timeout is None else time.time() + timeout
+        with self.cond:
+            while True:
+                result = get()
+                if result is not None:
+                    return result
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError("Timed out waiting for Roku debugger output")
+                self.cond.wait(remaining)
+
+    async def asyncWait(self, get):
+        '''Coroutine version of wait(), without a timeout; use asyncio.wait_for() to impose one.'''
+
+        waiter = (asyncio.get_event_loop(), asyncio.Event())
+        with self.cond:
+            self.waiters.append(waiter)
+        try:
+            while True:
+                with self.cond:
+                    result = get()
+                    if result is not None:
+                        return result
+                    # Cleared while holding the lock, so any output written after get() is checked will set it again
+                    waiter[1].clear()
+                await waiter[1].wait()
+        finally:
+            with self.cond:
+                self.waiters.remove(waiter)
+
+
+class DebugSession():
+    '''An in-process Roku debugging session, for driving a Roku from other Python programs, e.g. test harnesses.
+
+    Uses the same Roku reader and writer threads, renderer, line collapser and log file as roky itself,
+    but without the console windows or child process. For example:
+
+        with roky.DebugSession('192.168.0.6') as session:
+            session.waitFor(r'Brightscript Debugger>', timeout=30)
+            session.send('bt')
+
+        async with roky.DebugSession('192.168.0.6') as session:
+            await session.expect(r'Brightscript Debugger>', timeout=30)
+            session.send('bt')
+            async for chunk in session:
+                ...
+
+    The output can be consumed in two independent ways: as chunks, by read() and async iteration, and by matching,
+    with waitFor() and expect(). Each keeps its own place in the output, so chunks that have already been matched
+    are still returned by read() and async iteration, and vice versa.
+    '''
+
+    def __init__(self, host=ROKU, port=PORT, logFile=None, renderer='unicode', collapse=False, pattern=None, sourceDir=None):
+        '''Set up a session with a Roku debug port; connect() must be called to start it.
+
+        renderer is a renderer profile name or Renderer; collapse, pattern and sourceDir are as for the -r, -n and -d options.
+        '''
+
+        self.host = host
+        self.port = port
+        self.logFile = logFile
+        self.renderer = RENDERERS[renderer] if isinstance(renderer, str) else renderer
+        self.collapser = LineCollapser(pattern, self.renderer) if collapse or pattern else None
+        self.annotator = SourceAnnotator(SourceIndex(sourceDir).start(), self.renderer) if sourceDir else None
+        self.output = SessionOutput()
+        self.rokuWriterQ = queue.Queue()
+        self.rokuSocket = None
+        self.log = None
+
+    def connect(self):
+        '''Connect to the Roku, and start the Roku reader and writer threads.'''
+
+        self.rokuSocket = socket.create_connection((self.host, self.port))
+        self.log = LogWriter(self.logFile)
+        threading.Thread(target=rokuWriterThread, args=(self.rokuSocket, self.rokuWriterQ, self.output, self.log),
+                         daemon=True).start()
+        threading.Thread(target=rokuReaderThread,
+                         args=(self.rokuSocket, self.output, self.output, self.log, self.port, None, self.collapser,
+                               self.renderer, self.annotator),
+                         daemon=True).start()
+        return self
+
+    def send(self, cmd):
+        '''Send a debugger command to the Roku.'''
+
+        if not self.rokuSocket:
+            raise RuntimeError("DebugSession is not connected")
+        data = cmd.encode() + b'\r\n'
+        self.log.write(data)
+        self.rokuWriterQ.put_nowait(data)
+
+    def break_(self):
+        '''Break into the debugger, as Ctrl/C does in roky's command window.'''
+
+        if not self.rokuSocket:
+            raise RuntimeError("DebugSession is not connected")
+        self.rokuWriterQ.put_nowait(b'\x03')
+
+    def read(self, timeout=None):
+        '''Return the next chunk of decoded output, raising TimeoutError if none arrives, or EOFError once the output ends.'''
+
+        return self.output.wait(self.output.nextChunk, timeout)
+
+    def waitFor(self, pattern, timeout=None):
+        '''Wait for output matching the regex pattern, returning the match object.
+
+        Output up to the end of the match is consumed, so the next call only matches output after it.
+        Raises TimeoutError if there's no match in time, or EOFError if the output ends without one.
+        '''
+
+        regex = re.compile(pattern)
+        return self.output.wait(lambda: self.output.nextMatch(regex), timeout)
+
+    async def expect(self, pattern, timeout=None):
+        '''Coroutine version of waitFor(), raising asyncio.TimeoutError if there's no match in time.'''
+
+        regex = re.compile(pattern)
+        return (await asyncio.wait_for(self.output.asyncWait(lambda: self.output.nextMatch(regex)), timeout))
+
+    def close(self):
+        '''Close the connection to the Roku, which terminates the Roku reader and writer threads.'''
+
+        if self.rokuSocket:
+            self.rokuWriterQ.put_nowait(None)
+            try:
+                self.rokuSocket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.rokuSocket.close()
+            self.rokuSocket = None
+        if self.log:
+            self.log.close()
+
+    def __enter__(self):
+        return self.connect()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    async def __aenter__(self):
+        # Connecting blocks, so do it in the event loop's executor
+        return (await asyncio.get_event_loop().run_in_executor(None, self.connect))
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        '''Return the next chunk of decoded output, ending the iteration when the output ends.'''
+
+        try:
+            return (await self.output.asyncWait(self.output.nextChunk))
+        except EOFError:
+            raise StopAsyncIteration
+
+
 def getArgs():
     '''Parse command-line arguments.'''
 
@@ -557,7 +1801,20 @@ def getArgs():
                                      formatter_class=argparse.RawDescriptionHelpFormatter)      # [Python 3.2]
     parser.add_argument('-f', metavar='font-height', help="Consolas font height in pixels", type=int,
                         choices=[5, 6, 7, 8, 10, 12, 14, 16, 18, 20, 24, 28, 36, 72])
+    parser.add_argument('-u', metavar='renderer', help="how to display Unicode: auto (default), legacy, unicode or ascii",
+                        choices=['auto'] + sorted(RENDERERS), default='auto')
     parser.add_argument('-o', metavar='output-file', help="log debug output to file")
+    parser.add_argument('-k', metavar='compact-file', help="log debug output to file, with repeated lines collapsed")
+    parser.add_argument('-r', help="collapse repeated lines of debug output", action='store_true')
+    parser.add_argument('-n', metavar='normalize-regex', help="ignore text matching regex when comparing repeated lines",
+                        type=re.compile)
+    parser.add_argument('-d', metavar='source-dir', help="annotate backtraces with source lines from channel source directory")
+    parser.add_argument('-m', metavar='perf-file', help="sample channel CPU and memory usage, appending to time-series file")
+    parser.add_argument('-s', metavar='seconds', help="chanperf sampling interval (default 5)", type=float)
+    parser.add_argument('-x', metavar='profile-mode', help="profile roky itself: cprofile, sample or memory",
+                        choices=Profiler.MODES)
+    parser.add_argument('-p', metavar='extra-port', help="also capture output from this Roku port (may be repeated)",
+                        action='append', type=int)
     parser.add_argument('host', help="Roku's IP address (default " + ROKU + ")", nargs='?', default=ROKU)
     parser.add_argument('port', help="Roku's debugging port (default " + str(PORT) + ")", nargs='?', default=PORT, type=int)
     return parser.parse_args()
@@ -606,12 +1863,42 @@ def parentMain():
     sys.stdout = io.TextIOWrapper(sys.stdout.detach(), encoding='utf-8', errors='backslashreplace', line_buffering=True)   # Python 3.1
     print('Console encoding changed to: {}'.format(sys.stdout.encoding))
 
+    # Choose how to display Unicode characters, given what the console is able to display
+    renderer = detectRenderer(console) if args.u == 'auto' else RENDERERS[args.u]
+    print('Unicode renderer: {}'.format(renderer.name))
+
+    # Start indexing the channel source tree in the background if the -d <sourceDir> command-line option was specified
+    sourceIndex = SourceIndex(args.d).start() if args.d else None
+
     # Warn the user if not running a Windows OS, but continue anyway
     if os.name != 'nt':
         print("\nWARNING - This program has only been tested on Windows operating systems!\n")
 
-    # Create and open a log file if the -o <logFile> command-line option was specified
-    logWriter = LogWriter(args.o)
+    # Additional Roku ports to capture alongside the main debugging port, ignoring any duplicates
+    extraPorts = []
+    for extraPort in args.p or []:
+        if extraPort != args.port and extraPort not in extraPorts:
+            extraPorts.append(extraPort)
+
+    # Create and open a log file if the -o <logFile> command-line option was specified.
+    # When capturing several ports, the -o log file holds the merged output, with each port's output also logged to its own file.
+    # Similarly, a compact log file is created if the -k <compactFile> command-line option was specified.
+    if extraPorts:
+        mergedLogWriter = LogWriter(args.o)
+        logWriter = LogWriter(portLogFile(args.o, args.port), portLogFile(args.k, args.port), args.n)
+        extraLogWriters = [LogWriter(portLogFile(args.o, extraPort), portLogFile(args.k, extraPort), args.n)
+                           for extraPort in extraPorts]
+        timeline = Timeline(console, mergedLogWriter)
+    else:
+        mergedLogWriter = None
+        logWriter = LogWriter(args.o, args.k, args.n)
+        extraLogWriters = []
+        timeline = None
+
+    # Start profiling roky itself if the -x <profileMode> command-line option was specified, before any threads start.
+    # The profile is written by stopProfilerAtExit() if it's still running when roky exits.
+    if args.x:
+        print(profiler.start(args.x))
 
     # Create a queue for data to be sent to the Roku by the Roku writer thread
     rokuWriterQ = queue.Queue()
@@ -670,11 +1957,27 @@ def parentMain():
 
     print("Connected to {}:{}\n".format(args.host, args.port))
 
+    # Create a socket for each of the additional Roku ports to be captured
+    extraSockets = []
+    for extraPort in extraPorts:
+        try:
+            extraSockets.append(socket.create_connection((args.host, extraPort)))
+        except Exception as e:
+            print("\n{}\n\nroky: Unable to connect to Roku socket at {}:{}".format(e, args.host, extraPort))
+            # Nothing has started using the connections made so far, nor the child process, so close them all
+            for openSocket in [rokuSocket] + extraSockets:
+                openSocket.close()
+            proc.kill()
+            sock.close()
+            return
+        print("Connected to {}:{}\n".format(args.host, extraPort))
+
     # Start a thread to receive console input data from the user.
     # This thread can start first. It doesn't rely on the other threads being available yet,
     # as it writes to a queue.
     try:
-        threading.Thread(target=consoleThread, args=(sock, rokuWriterQ, quitQ, logWriter), daemon=True).start()
+        threading.Thread(target=consoleThread, args=(sock, rokuWriterQ, quitQ, logWriter, timeline, args.port),
+                         daemon=True).start()
     except Exception as e:
         tPrint("\n{}\n\nroky: Unable to start console reader thread".format(e))
         sock.close()
@@ -688,18 +1991,56 @@ def parentMain():
         sock.close()
         return
 
-    # Start a thread to receive data from the Roku.
-    # Start this thread last because it writes to stdout, which is not thread-safe.
+    # Start a thread to write the merged output of all the Roku ports being captured.
+    # It won't write anything to stdout until the Roku reader threads give it some data.
+    if timeline:
+        try:
+            threading.Thread(target=timelineThread, args=(timeline, quitQ), daemon=True).start()
+        except Exception as e:
+            tPrint("\n{}\n\nroky: Unable to start timeline thread".format(e))
+            sock.close()
+            return
+
+    # Each Roku reader thread needs its own line collapser if repeated lines are to be collapsed (-r or -n).
+    # Counts are only updated in place when a single port's output is written straight to a console. Otherwise,
+    # the timeline could put another port's output part-way through the count's line, and a pipe would keep every update.
+    def lineCollapser():
+        inPlace = not timeline and (console.console or console.mintty or sys.stdout.isatty())
+        return LineCollapser(args.n, renderer, inPlace) if args.r or args.n else None
+
+    # Each Roku reader thread also needs its own source annotator, all sharing the one source index (-d)
+    def sourceAnnotator():
+        return SourceAnnotator(sourceIndex, renderer) if sourceIndex else None
+
+    # Start a thread to receive data from the Roku, and one for each additional Roku port being captured.
+    # Start these threads last because they write to stdout, which is not thread-safe.
     # If anything goes wrong when starting up either of the other two threads, we might get an
     # exception if the failed thread tries to print to stdout at the same time as the rokuReader thread is printing to stdout.
     # After the rokuReader thread starts, there should be no other threads writing to stdout until the program terminates.
     try:
-        threading.Thread(target=rokuReaderThread, args=(rokuSocket, console, quitQ, logWriter), daemon=True).start()
+        threading.Thread(target=rokuReaderThread,
+                         args=(rokuSocket, console, quitQ, logWriter, args.port, timeline, lineCollapser(),
+                               renderer, sourceAnnotator()),
+                         daemon=True).start()
+        for extraPort, extraSocket, extraLogWriter in zip(extraPorts, extraSockets, extraLogWriters):
+            threading.Thread(target=rokuReaderThread,
+                             args=(extraSocket, console, quitQ, extraLogWriter, extraPort, timeline, lineCollapser(),
+                                   renderer, sourceAnnotator()),
+                             daemon=True).start()
     except Exception as e:
         tPrint("\n{}\n\nroky: Unable to start Roku reader thread".format(e))
         sock.close()
         return
 
+    # Start a thread to sample the channel's CPU and memory usage if either the -m or -s command-line option was specified
+    perfWriter = PerfWriter(args.m)
+    if args.m or args.s:
+        try:
+            threading.Thread(target=perfSamplerThread, args=(args.host, max(args.s or 5, 1), console, perfWriter),
+                             daemon=True).start()
+        except Exception as e:
+            tPrint("\n{}\n\nroky: Unable to start chanperf sampler thread".format(e))
+
     # Wait for any of the worker threads to terminate
     quitMsg = quitQ.get()
 
@@ -718,8 +2059,13 @@ def parentMain():
     except:
         pass
 
-    # Close the log file if it was opened
+    # Close the log files if they were opened
     logWriter.close()
+    for extraLogWriter in extraLogWriters:
+        extraLogWriter.close()
+    if mergedLogWriter:
+        mergedLogWriter.close()
+    perfWriter.close()
 
     # Restore the old font if it was changed
     # [Windows-only]